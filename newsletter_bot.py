@@ -1,26 +1,49 @@
+import asyncio
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import httpx
+import lxml.html
+from lxml.cssselect import CSSSelector
 import feedparser
+import diskcache
 import json
+import csv
+import heapq
+import hashlib
 import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import email.policy
+from email.message import EmailMessage
 from datetime import datetime, timedelta
 import time
 import os
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor, wait
+from itertools import chain, islice
+from operator import attrgetter
 from dataclasses import dataclass, asdict
 from typing import List, Dict
 import openai
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 from googleapiclient.discovery import build
 from google.oauth2.credentials import Credentials
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 from dotenv import load_dotenv
-import pandas as pd
 
 # Load environment variables
 load_dotenv()
 
+# Template for a single article in the newsletter HTML
+_ARTICLE_TEMPLATE = """
+        <div class="article">
+            <h3><a href="{url}" style="color: #1e293b; text-decoration: none;">{title}</a></h3>
+            <div class="meta">Source: {source} | Relevance: {relevance_score}/10</div>
+            {summary_html}
+            <div class="tags">{tags_html}</div>
+        </div>
+        """
+
 @dataclass
 class NewsItem:
     title: str
@@ -37,6 +60,20 @@ class NewsletterBot:
         self.gmail_user = os.getenv('GMAIL_USER')
         self.gmail_password = os.getenv('GMAIL_APP_PASSWORD')  # Use App Password
         self.google_sheets_creds = os.getenv('GOOGLE_SHEETS_CREDS_PATH')
+        self.http_headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+        }
+        
+        # Shared session so feed fetches reuse pooled connections
+        self.http = requests.Session()
+        self.http.headers.update(self.http_headers)
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=16,
+            max_retries=Retry(total=2, backoff_factor=0.3)
+        )
+        self.http.mount('https://', adapter)
+        self.http.mount('http://', adapter)
         
         # Content sources configuration
         self.sources = {
@@ -62,148 +99,277 @@ class NewsletterBot:
             ]
         }
         
+        # Compile CSS selectors once rather than on every scrape
+        for site in self.sources['websites']:
+            site['compiled_selector'] = CSSSelector(site['selector'])
+        
         # Initialize OpenAI
         if self.openai_api_key:
             openai.api_key = self.openai_api_key
+        
+        # Relevance scores persist across runs so repeat articles aren't re-scored
+        self.score_cache = diskcache.Cache('.relevance_cache')
+        
+        # Feed validators and items persist so unchanged feeds aren't re-downloaded
+        self.feed_cache = diskcache.Cache('.feed_cache')
+        
+        # Authorize Google Sheets once rather than on every save
+        self.sheets_client = self._authorize_google_sheets()
 
     def scrape_rss_feeds(self) -> List[NewsItem]:
         """Scrape content from RSS feeds"""
+        feeds = self.sources['rss_feeds']
+        if not feeds:
+            return []
+        
+        # Feeds are network-bound, so fetch them concurrently
+        with ThreadPoolExecutor(max_workers=min(32, len(feeds))) as executor:
+            results = list(executor.map(self._parse_one_feed, feeds))
+        
+        return list(chain.from_iterable(results))
+
+    def _parse_one_feed(self, feed_url: str) -> List[NewsItem]:
+        """Parse a single RSS feed into news items"""
         news_items = []
         
-        for feed_url in self.sources['rss_feeds']:
-            try:
-                feed = feedparser.parse(feed_url)
-                for entry in feed.entries[:5]:  # Limit to 5 most recent
-                    # Get published date
-                    pub_date = entry.get('published', datetime.now().isoformat())
-                    
-                    # Create news item
-                    item = NewsItem(
-                        title=entry.title,
-                        url=entry.link,
-                        summary=entry.get('summary', '')[:300],
-                        source=feed.feed.get('title', 'Unknown'),
-                        published_date=pub_date,
-                        relevance_score=0.0,
-                        tags=[]
-                    )
-                    news_items.append(item)
-                    
-            except Exception as e:
-                print(f"Error scraping RSS feed {feed_url}: {e}")
+        try:
+            # Ask the server to skip the download if the feed hasn't changed
+            cached = self.feed_cache.get(feed_url)
+            headers = {}
+            if cached is not None:
+                if cached['etag']:
+                    headers['If-None-Match'] = cached['etag']
+                if cached['last_modified']:
+                    headers['If-Modified-Since'] = cached['last_modified']
+            
+            # Fetch with an explicit timeout; feedparser's own fetcher has none
+            response = self.http.get(feed_url, headers=headers, timeout=(3, 10))
+            if response.status_code == 304 and cached is not None:
+                return [NewsItem(**item) for item in cached['items']]
+            response.raise_for_status()
+            
+            feed = feedparser.parse(response.content)
+            for entry in feed.entries[:5]:  # Limit to 5 most recent
+                # Get published date
+                pub_date = entry.get('published', datetime.now().isoformat())
                 
+                # Create news item
+                item = NewsItem(
+                    title=entry.title,
+                    url=entry.link,
+                    summary=entry.get('summary', '')[:300],
+                    source=feed.feed.get('title', 'Unknown'),
+                    published_date=pub_date,
+                    relevance_score=0.0,
+                    tags=[]
+                )
+                news_items.append(item)
+            
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            if etag or last_modified:
+                self.feed_cache.set(
+                    feed_url,
+                    {
+                        'etag': etag,
+                        'last_modified': last_modified,
+                        'items': [asdict(item) for item in news_items]
+                    },
+                    expire=30 * 86400
+                )
+                
+        except Exception as e:
+            print(f"Error scraping RSS feed {feed_url}: {e}")
+            
         return news_items
 
     def scrape_websites(self) -> List[NewsItem]:
         """Scrape content from specific websites"""
         news_items = []
         
-        for site in self.sources['websites']:
-            try:
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-                }
-                response = requests.get(site['url'], headers=headers, timeout=10)
-                soup = BeautifulSoup(response.content, 'html.parser')
-                
-                # Find articles using CSS selector
-                articles = soup.select(site['selector'])[:5]
-                
-                for article in articles:
-                    title = article.get_text().strip()
-                    url = article.get('href', '')
-                    
-                    # Make URL absolute if relative
-                    if url.startswith('/'):
-                        url = site['url'].rstrip('/') + url
-                    
-                    item = NewsItem(
-                        title=title,
-                        url=url,
-                        summary='',
-                        source=site['name'],
-                        published_date=datetime.now().isoformat(),
-                        relevance_score=0.0,
-                        tags=[]
-                    )
-                    news_items.append(item)
-                    
-            except Exception as e:
-                print(f"Error scraping website {site['name']}: {e}")
+        results = asyncio.run(self._scrape_websites_async())
+        
+        for site, result in zip(self.sources['websites'], results):
+            if isinstance(result, Exception):
+                print(f"Error scraping website {site['name']}: {result}")
+            else:
+                news_items.extend(result)
                 
         return news_items
 
+    async def _scrape_websites_async(self) -> List:
+        """Fetch and parse every configured website over a shared HTTP client"""
+        # Keep-alive pool shared across sites, retrying failed connections
+        transport = httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=2,
+            limits=httpx.Limits(max_connections=16, max_keepalive_connections=16)
+        )
+        async with httpx.AsyncClient(
+            transport=transport, headers=self.http_headers, follow_redirects=True
+        ) as client:
+            return await asyncio.gather(
+                *[self._scrape_website(client, site) for site in self.sources['websites']],
+                return_exceptions=True
+            )
+
+    async def _scrape_website(self, client: httpx.AsyncClient, site: Dict) -> List[NewsItem]:
+        """Fetch a single website, parsing it off the event loop"""
+        response = await client.get(site['url'], timeout=10)
+        return await asyncio.to_thread(self._parse_website, response.content, site)
+
+    def _parse_website(self, content: bytes, site: Dict) -> List[NewsItem]:
+        """Extract news items from a website's HTML"""
+        news_items = []
+        tree = lxml.html.fromstring(content)
+        
+        # Find articles using CSS selector
+        articles = site['compiled_selector'](tree)[:5]
+        base_url = site['url']
+        
+        for article in articles:
+            title = article.text_content().strip()
+            
+            # Resolve relative, protocol-relative and anchor links against the site
+            url = urljoin(base_url, article.get('href') or '')
+            
+            item = NewsItem(
+                title=title,
+                url=url,
+                summary='',
+                source=site['name'],
+                published_date=datetime.now().isoformat(),
+                relevance_score=0.0,
+                tags=[]
+            )
+            news_items.append(item)
+            
+        return news_items
+
     def analyze_relevance(self, news_items: List[NewsItem]) -> List[NewsItem]:
         """Use AI to analyze relevance to AI + Māori topics"""
         if not self.openai_api_key:
             print("No OpenAI API key found, skipping AI analysis")
             return news_items
         
+        # Reuse scores from previous runs where available
+        uncached_items = []
         for item in news_items:
-            try:
-                prompt = f"""
-                Analyze this news article for relevance to AI technology and Māori/Indigenous topics.
-                
-                Title: {item.title}
-                Summary: {item.summary}
-                Source: {item.source}
-                
-                Rate relevance on a scale of 0-10 where:
-                - 10: Directly about AI AND Māori/Indigenous topics
-                - 7-9: Strongly related to AI with Indigenous connections
-                - 4-6: General AI news that could be relevant
-                - 1-3: Tangentially related
-                - 0: Not relevant
-                
-                Also provide 2-3 relevant tags.
-                
-                Respond in JSON format:
-                {
-                    "relevance_score": 0-10,
-                    "tags": ["tag1", "tag2", "tag3"],
-                    "reasoning": "brief explanation"
-                }
-                """
-                
-                response = openai.ChatCompletion.create(
+            cached = self.score_cache.get(self._relevance_cache_key(item))
+            if cached is not None:
+                item.relevance_score, item.tags = cached
+            else:
+                uncached_items.append(item)
+        
+        print(f"Using cached relevance scores for {len(news_items) - len(uncached_items)} items")
+        
+        if uncached_items:
+            asyncio.run(self._analyze_relevance_async(uncached_items))
+        
+        return news_items
+
+    def _relevance_cache_key(self, item: NewsItem) -> str:
+        """Build the relevance cache key for an item"""
+        return hashlib.md5((item.url + item.title).encode('utf-8')).hexdigest()
+
+    async def _analyze_relevance_async(self, news_items: List[NewsItem]):
+        """Score all items in batches, bounded by a semaphore"""
+        semaphore = asyncio.Semaphore(8)
+        remaining = iter(news_items)
+        batches = list(iter(lambda: list(islice(remaining, 15)), []))
+        await asyncio.gather(*[self._score_batch(batch, semaphore) for batch in batches])
+
+    async def _score_batch(self, batch: List[NewsItem], semaphore: asyncio.Semaphore):
+        """Score a batch of items with a single API call"""
+        articles = [
+            {'id': i, 'title': item.title, 'summary': item.summary, 'source': item.source}
+            for i, item in enumerate(batch)
+        ]
+        
+        try:
+            prompt = f"""
+            Analyze each of these news articles for relevance to AI technology and Māori/Indigenous topics.
+            
+            Articles:
+            {json.dumps(articles, ensure_ascii=False)}
+            
+            Rate relevance on a scale of 0-10 where:
+            - 10: Directly about AI AND Māori/Indigenous topics
+            - 7-9: Strongly related to AI with Indigenous connections
+            - 4-6: General AI news that could be relevant
+            - 1-3: Tangentially related
+            - 0: Not relevant
+            
+            Also provide 2-3 relevant tags for each article.
+            
+            Respond in JSON format, with one result per article id:
+            {{
+                "results": [
+                    {{"id": 0, "relevance_score": 0-10, "tags": ["tag1", "tag2", "tag3"]}}
+                ]
+            }}
+            """
+            
+            async with semaphore:
+                response = await self._create_chat_completion(
                     model="gpt-3.5-turbo",
                     messages=[{"role": "user", "content": prompt}],
-                    max_tokens=200
+                    max_tokens=1000,
+                    response_format={"type": "json_object"}
                 )
-                
-                result = json.loads(response.choices[0].message.content)
+            
+            results = json.loads(response.choices[0].message.content).get('results', [])
+            scores = {str(result.get('id')): result for result in results}
+            
+        except Exception as e:
+            print(f"Error analyzing batch of {len(batch)} items: {e}")
+            scores = {}
+        
+        for i, item in enumerate(batch):
+            result = scores.get(str(i))
+            if result is None:
+                print(f"No relevance score returned for {item.title}")
+                item.relevance_score = 5.0  # Default score
+            else:
                 item.relevance_score = result.get('relevance_score', 0)
                 item.tags = result.get('tags', [])
-                
-            except Exception as e:
-                print(f"Error analyzing item {item.title}: {e}")
-                item.relevance_score = 5.0  # Default score
-                
-        return news_items
+                self.score_cache.set(
+                    self._relevance_cache_key(item),
+                    (item.relevance_score, item.tags),
+                    expire=30 * 86400  # Refresh scores monthly
+                )
+
+    @retry(
+        retry=retry_if_exception_type(openai.error.RateLimitError),
+        wait=wait_random_exponential(min=1, max=30),
+        stop=stop_after_attempt(5),
+        reraise=True
+    )
+    async def _create_chat_completion(self, **kwargs):
+        """Call the chat completion API, backing off when rate limited"""
+        return await openai.ChatCompletion.acreate(**kwargs)
 
     def filter_and_rank_content(self, news_items: List[NewsItem]) -> List[NewsItem]:
         """Filter content by relevance and remove duplicates"""
-        # Remove duplicates by URL
+        # Remove duplicates by URL and filter by relevance score (keep items
+        # with score >= 4) in a single pass
         seen_urls = set()
-        unique_items = []
+        relevant_items = []
         for item in news_items:
-            if item.url not in seen_urls:
-                seen_urls.add(item.url)
-                unique_items.append(item)
+            if item.url in seen_urls:
+                continue
+            seen_urls.add(item.url)
+            if item.relevance_score >= 4.0:
+                relevant_items.append(item)
         
-        # Filter by relevance score (keep items with score >= 4)
-        relevant_items = [item for item in unique_items if item.relevance_score >= 4.0]
-        
-        # Sort by relevance score (highest first)
-        relevant_items.sort(key=lambda x: x.relevance_score, reverse=True)
-        
-        return relevant_items[:15]  # Keep top 15 items
+        # Keep the top 15 items by relevance score (highest first)
+        return heapq.nlargest(15, relevant_items, key=lambda x: x.relevance_score)
 
     def generate_newsletter_html(self, news_items: List[NewsItem]) -> str:
         """Generate HTML newsletter content"""
         current_date = datetime.now().strftime("%B %d, %Y")
         
-        html_content = f"""
+        parts = [f"""
         <!DOCTYPE html>
         <html>
         <head>
@@ -230,23 +396,23 @@ class NewsletterBot:
             <div style="margin: 30px 0;">
                 <p>Kia ora! Here are this week's most relevant AI developments for Māori organisations and communities.</p>
             </div>
-        """
+        """]
         
         # Add high relevance items first
         high_relevance = [item for item in news_items if item.relevance_score >= 7]
         if high_relevance:
-            html_content += "<h2 style='color: #7c3aed; border-bottom: 2px solid #7c3aed; padding-bottom: 5px;'>🔥 Top Stories</h2>"
+            parts.append("<h2 style='color: #7c3aed; border-bottom: 2px solid #7c3aed; padding-bottom: 5px;'>🔥 Top Stories</h2>")
             for item in high_relevance:
-                html_content += self._format_article_html(item)
+                parts.append(self._format_article_html(item))
         
         # Add other relevant items
         other_items = [item for item in news_items if item.relevance_score < 7]
         if other_items:
-            html_content += "<h2 style='color: #1e3a8a; border-bottom: 2px solid #1e3a8a; padding-bottom: 5px;'>📰 AI News & Updates</h2>"
+            parts.append("<h2 style='color: #1e3a8a; border-bottom: 2px solid #1e3a8a; padding-bottom: 5px;'>📰 AI News & Updates</h2>")
             for item in other_items:
-                html_content += self._format_article_html(item)
+                parts.append(self._format_article_html(item))
         
-        html_content += """
+        parts.append("""
             <div class="footer">
                 <p>This newsletter is powered by AI content curation.</p>
                 <p>Questions or feedback? Reply to this email.</p>
@@ -254,29 +420,41 @@ class NewsletterBot:
             </div>
         </body>
         </html>
-        """
+        """)
         
-        return html_content
+        return ''.join(parts)
 
     def _format_article_html(self, item: NewsItem) -> str:
         """Format individual article for HTML newsletter"""
         tags_html = ' '.join([f'<span class="tag">{tag}</span>' for tag in item.tags])
         
-        return f"""
-        <div class="article">
-            <h3><a href="{item.url}" style="color: #1e293b; text-decoration: none;">{item.title}</a></h3>
-            <div class="meta">Source: {item.source} | Relevance: {item.relevance_score}/10</div>
-            {f'<p>{item.summary}</p>' if item.summary else ''}
-            <div class="tags">{tags_html}</div>
-        </div>
-        """
+        return _ARTICLE_TEMPLATE.format_map({
+            'url': item.url,
+            'title': item.title,
+            'source': item.source,
+            'relevance_score': item.relevance_score,
+            'summary_html': f'<p>{item.summary}</p>' if item.summary else '',
+            'tags_html': tags_html
+        })
 
-    def save_to_google_sheets(self, news_items: List[NewsItem]):
-        """Save curated content to Google Sheets for review"""
+    def _authorize_google_sheets(self):
+        """Authorize a Google Sheets client from the service account credentials"""
         try:
             scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
             creds = ServiceAccountCredentials.from_json_keyfile_name(self.google_sheets_creds, scope)
-            client = gspread.authorize(creds)
+            return gspread.authorize(creds)
+        except Exception as e:
+            print(f"Error authorizing Google Sheets: {e}")
+            return None
+
+    def save_to_google_sheets(self, news_items: List[NewsItem]):
+        """Save curated content to Google Sheets for review"""
+        if self.sheets_client is None:
+            print("Google Sheets not authorized, skipping save")
+            return
+        
+        try:
+            client = self.sheets_client
             
             # Open or create spreadsheet
             try:
@@ -287,17 +465,15 @@ class NewsletterBot:
                 # Add headers
                 sheet.append_row(['Date', 'Title', 'URL', 'Source', 'Relevance Score', 'Tags', 'Summary'])
             
-            # Add content
-            for item in news_items:
-                sheet.append_row([
-                    datetime.now().strftime("%Y-%m-%d"),
-                    item.title,
-                    item.url,
-                    item.source,
-                    item.relevance_score,
-                    ', '.join(item.tags),
-                    item.summary[:200]  # Truncate for sheets
-                ])
+            # Add content in a single API call
+            today = datetime.now().strftime("%Y-%m-%d")
+            get_fields = attrgetter('title', 'url', 'source', 'relevance_score', 'tags', 'summary')
+            rows = [
+                [today, title, url, source, relevance_score, ', '.join(tags), summary[:200]]  # Truncate summary for sheets
+                for title, url, source, relevance_score, tags, summary in map(get_fields, news_items)
+            ]
+            if rows:
+                sheet.append_rows(rows)
                 
         except Exception as e:
             print(f"Error saving to Google Sheets: {e}")
@@ -309,23 +485,32 @@ class NewsletterBot:
             server.starttls()
             server.login(self.gmail_user, self.gmail_password)
             
-            for recipient in recipient_list:
-                msg = MIMEMultipart('alternative')
-                msg['Subject'] = f"AI & Māori Weekly - {datetime.now().strftime('%B %d, %Y')}"
-                msg['From'] = self.gmail_user
-                msg['To'] = recipient
-                
-                html_part = MIMEText(html_content, 'html')
-                msg.attach(html_part)
-                
-                server.send_message(msg)
-                print(f"Newsletter sent to {recipient}")
+            # Build and encode the message once; only the envelope changes per batch
+            msg = EmailMessage()
+            msg['Subject'] = f"AI & Māori Weekly - {datetime.now().strftime('%B %d, %Y')}"
+            msg['From'] = self.gmail_user
+            msg['To'] = self.gmail_user
+            msg.set_content(html_content, subtype='html', cte='quoted-printable')
+            message_bytes = msg.as_bytes(policy=email.policy.SMTP)
+            
+            # Send to recipients in batches of 50 per SMTP envelope. Recipients
+            # are only given as envelope addresses so they stay hidden from
+            # one another, as with BCC.
+            recipients = iter(recipient_list)
+            for batch in iter(lambda: list(islice(recipients, 50)), []):
+                server.sendmail(self.gmail_user, batch, message_bytes)
+                print(f"Newsletter sent to {len(batch)} recipients")
                 
             server.quit()
             
         except Exception as e:
             print(f"Error sending newsletter: {e}")
 
+    def _save_newsletter_file(self, newsletter_html: str):
+        """Save newsletter HTML to a dated file for review"""
+        with open(f'newsletter_{datetime.now().strftime("%Y%m%d")}.html', 'w', encoding='utf-8') as f:
+            f.write(newsletter_html)
+
     def run_weekly_collection(self):
         """Main method to run the weekly content collection and newsletter generation"""
         print(f"Starting weekly content collection - {datetime.now()}")
@@ -345,15 +530,18 @@ class NewsletterBot:
         
         print(f"Final curated list: {len(final_items)} items")
         
-        # Save to Google Sheets for review
-        self.save_to_google_sheets(final_items)
-        
-        # Generate newsletter
-        newsletter_html = self.generate_newsletter_html(final_items)
-        
-        # Save newsletter to file for review
-        with open(f'newsletter_{datetime.now().strftime("%Y%m%d")}.html', 'w', encoding='utf-8') as f:
-            f.write(newsletter_html)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            # Save to Google Sheets for review in the background
+            sheets_future = executor.submit(self.save_to_google_sheets, final_items)
+            
+            # Generate newsletter
+            newsletter_html = self.generate_newsletter_html(final_items)
+            
+            # Save newsletter to file for review
+            file_future = executor.submit(self._save_newsletter_file, newsletter_html)
+            
+            wait([sheets_future, file_future])
+            file_future.result()
         
         print("Newsletter generated and saved for review")
         
@@ -378,10 +566,11 @@ if __name__ == "__main__":
         try:
             # Try to load subscribers from CSV
             if os.path.exists('subscribers.csv'):
-                subscribers_df = pd.read_csv('subscribers.csv')
-                active_subscribers = subscribers_df[
-                    subscribers_df.get('status', 'active') == 'active'
-                ]['email'].tolist()
+                with open('subscribers.csv', newline='', encoding='utf-8') as f:
+                    active_subscribers = [
+                        row['email'] for row in csv.DictReader(f)
+                        if row.get('status', 'active') == 'active'
+                    ]
                 
                 if active_subscribers:
                     bot.send_newsletter(newsletter, active_subscribers)